@@ -2,7 +2,7 @@
 
 from __future__ import annotations
 
-import re
+import functools
 from pathlib import Path
 from typing import Dict, Iterable, List, Optional, Set, Tuple
 
@@ -28,33 +28,39 @@ from .constants import LIV_JUNIOR, LIV_SENIOR
 from .rules import build_default_rules
 
 
+@functools.lru_cache(maxsize=4096)
 def _norm_name(name: str) -> str:
     """Normalizza un nome per confronti robusti (trim + casefold)."""
-    return re.sub(r"\s+", " ", name).strip().casefold()
+    return " ".join(name.split()).casefold()
 
 
-def _match_person_identifier(
-    value: Optional[str],
+def _indice_identificativi(
     roster: Iterable[str],
     profiles: Dict[str, PersonProfile],
-) -> Optional[str]:
-    """Risolvo un identificativo (nome o cognome) nel roster."""
-    if not value:
-        return None
-    target_norm = _norm_name(value)
+) -> Dict[str, str]:
+    """Associa ogni identificativo normalizzato (nome, nome completo, cognome) al nome nel roster.
 
+    A parità di identificativo vince il primo inserito: prima i nomi del roster,
+    poi i profili nell'ordine dato.
+    """
+    indice: Dict[str, str] = {}
     for name in roster:
-        if _norm_name(name) == target_norm:
-            return name
-
+        indice.setdefault(_norm_name(name), name)
     for name, profile in profiles.items():
         display = profile.display_name
-        if display and _norm_name(display) == target_norm:
-            return name
+        if display:
+            indice.setdefault(_norm_name(display), name)
         cognome = profile.cognome or ""
-        if cognome and _norm_name(cognome) == target_norm:
-            return name
-    return None
+        if cognome:
+            indice.setdefault(_norm_name(cognome), name)
+    return indice
+
+
+def _match_person_identifier(value: Optional[str], indice: Dict[str, str]) -> Optional[str]:
+    """Risolvo un identificativo (nome o cognome) tramite l'indice del roster."""
+    if not value:
+        return None
+    return indice.get(_norm_name(value))
 
 
 def carica_nomi(path: Path) -> List[str]:
@@ -147,9 +153,12 @@ def build_program_config_from_files(
     esperienza = {nome: profilo.livello for nome, profilo in persone.items()}
     weekly_caps = {nome: profilo.weekly_cap for nome, profilo in persone.items()}
 
+    indice_autisti = _indice_identificativi(elenco_autisti, persone)
+    indice_vigili = _indice_identificativi(elenco_vigili, persone)
+
     coppie_vietate: List[ConstraintRule] = []
     for primo, secondo in DEFAULT_FORBIDDEN_PAIRS:
-        ids = (_match_person_identifier(primo, elenco_vigili, persone), _match_person_identifier(secondo, elenco_vigili, persone))
+        ids = (_match_person_identifier(primo, indice_vigili), _match_person_identifier(secondo, indice_vigili))
         if all(ids):
             coppie_vietate.append(
                 ConstraintRule(primo=ids[0], secondo=ids[1], is_hard=True)
@@ -157,16 +166,16 @@ def build_program_config_from_files(
 
     coppie_preferite: List[PreferredRule] = []
     for autista_nome, vigile_nome in DEFAULT_PREFERRED_PAIRS:
-        autista_id = _match_person_identifier(autista_nome, elenco_autisti, persone)
-        vigile_id = _match_person_identifier(vigile_nome, elenco_vigili, persone)
+        autista_id = _match_person_identifier(autista_nome, indice_autisti)
+        vigile_id = _match_person_identifier(vigile_nome, indice_vigili)
         if autista_id and vigile_id:
             coppie_preferite.append(
                 PreferredRule(autista=autista_id, vigile=vigile_id, is_hard=False)
             )
 
-    autista_varchi = _match_person_identifier(DEFAULT_AUTISTA_VARCHI, elenco_autisti, persone)
-    autista_pogliani = _match_person_identifier(DEFAULT_AUTISTA_POGLIANI, elenco_autisti, persone)
-    vigile_estivo = _match_person_identifier(DEFAULT_VIGILE_ESCLUSO_ESTATE, elenco_vigili, persone)
+    autista_varchi = _match_person_identifier(DEFAULT_AUTISTA_VARCHI, indice_autisti)
+    autista_pogliani = _match_person_identifier(DEFAULT_AUTISTA_POGLIANI, indice_autisti)
+    vigile_estivo = _match_person_identifier(DEFAULT_VIGILE_ESCLUSO_ESTATE, indice_vigili)
 
     return ProgramConfig(
         autisti=elenco_autisti,
@@ -2,12 +2,15 @@
 
 from __future__ import annotations
 
+import functools
 import itertools
 import logging
 import random
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 from datetime import date, timedelta
-from typing import Dict, Iterable, List, Optional, Set, Tuple
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
 
 from database import (
     ProgramConfig,
@@ -17,7 +20,7 @@ from database import (
 )
 
 from .constants import LIV_JUNIOR, LIV_SENIOR, SUMMER_EXCLUDED_MONTHS
-from .rules import RuleMode, merge_with_defaults
+from .rules import GenerationRuleConfig, RuleMode, merge_with_defaults
 
 
 def date_attive_anno(
@@ -46,69 +49,140 @@ def date_attive_anno(
     return risultati
 
 
-@dataclass
 class Conteggi:
-    """Tiene traccia delle statistiche di assegnazione per autisti e vigili."""
-
-    annuale: Dict[str, int] = field(default_factory=dict)
-    per_mese: Dict[str, Dict[int, int]] = field(default_factory=dict)
-    per_mese_giorno: Dict[str, Dict[int, Dict[int, int]]] = field(default_factory=dict)
-    per_giorno_anno: Dict[str, Dict[int, int]] = field(default_factory=dict)
-    per_settimana: Dict[str, Dict[Tuple[int, int], int]] = field(default_factory=dict)
-    ultimo_giorno: Dict[str, Optional[int]] = field(default_factory=dict)
-
-    def assicura_persona(self, nome: str) -> None:
-        if nome not in self.annuale:
-            self.annuale[nome] = 0
-        if nome not in self.per_mese:
-            self.per_mese[nome] = {mese: 0 for mese in range(1, 13)}
-        if nome not in self.per_mese_giorno:
-            self.per_mese_giorno[nome] = {
-                mese: {dow: 0 for dow in range(7)} for mese in range(1, 13)
-            }
-        if nome not in self.per_giorno_anno:
-            self.per_giorno_anno[nome] = {dow: 0 for dow in range(7)}
-        if nome not in self.per_settimana:
-            self.per_settimana[nome] = {}
-        if nome not in self.ultimo_giorno:
-            self.ultimo_giorno[nome] = None
-
-    def aggiungi(self, nome: str, giorno: date) -> None:
-        self.assicura_persona(nome)
-        mese = giorno.month
-        dow = giorno.weekday()
-        week_key = (giorno.isocalendar().year, giorno.isocalendar().week)
+    """Tiene traccia delle statistiche di assegnazione per autisti e vigili.
+
+    I contatori sono array NumPy con una riga per persona: `indice` associa ogni
+    nome alla propria riga, i mesi sono indicizzati 1-12 e le settimane con la
+    posizione della settimana ISO nel calendario pianificato.
+    """
+
+    def __init__(self, nomi: Iterable[str], n_settimane: int) -> None:
+        self.indice: Dict[str, int] = {nome: i for i, nome in enumerate(dict.fromkeys(nomi))}
+        n = len(self.indice)
+        self.annuale: np.ndarray = np.zeros(n, dtype=np.int32)
+        self.per_mese: np.ndarray = np.zeros((n, 13), dtype=np.int32)
+        self.per_mese_giorno: np.ndarray = np.zeros((n, 13, 7), dtype=np.int32)
+        self.per_giorno_anno: np.ndarray = np.zeros((n, 7), dtype=np.int32)
+        self.per_settimana: np.ndarray = np.zeros((n, n_settimane), dtype=np.int32)
+        # -1 = nessun turno ancora assegnato
+        self.ultimo_giorno: np.ndarray = np.full(n, -1, dtype=np.int8)
+
+    def assicura_persona(self, nome: str) -> int:
+        """Ritorna la riga della persona, aggiungendone una vuota se non censita."""
+        i = self.indice.get(nome)
+        if i is not None:
+            return i
+        i = len(self.indice)
+        self.indice[nome] = i
+        self.annuale = np.concatenate((self.annuale, [0])).astype(np.int32)
+        self.per_mese = np.concatenate((self.per_mese, np.zeros((1, 13), dtype=np.int32)))
+        self.per_mese_giorno = np.concatenate((self.per_mese_giorno, np.zeros((1, 13, 7), dtype=np.int32)))
+        self.per_giorno_anno = np.concatenate((self.per_giorno_anno, np.zeros((1, 7), dtype=np.int32)))
+        self.per_settimana = np.concatenate(
+            (self.per_settimana, np.zeros((1, self.per_settimana.shape[1]), dtype=np.int32))
+        )
+        self.ultimo_giorno = np.concatenate((self.ultimo_giorno, [-1])).astype(np.int8)
+        return i
 
-        self.annuale[nome] += 1
-        self.per_mese[nome][mese] += 1
-        self.per_mese_giorno[nome][mese][dow] += 1
-        self.per_giorno_anno[nome][dow] += 1
-        self.per_settimana[nome][week_key] = self.per_settimana[nome].get(week_key, 0) + 1
-        self.ultimo_giorno[nome] = dow
+    def aggiungi(self, i: int, mese: int, dow: int, settimana: int) -> None:
+        self.annuale[i] += 1
+        self.per_mese[i, mese] += 1
+        self.per_mese_giorno[i, mese, dow] += 1
+        self.per_giorno_anno[i, dow] += 1
+        self.per_settimana[i, settimana] += 1
+        self.ultimo_giorno[i] = dow
 
     def tot_mese(self, nome: str, mese: int) -> int:
-        self.assicura_persona(nome)
-        return self.per_mese[nome][mese]
+        return int(self.per_mese[self.assicura_persona(nome), mese])
 
     def tot_annuale(self, nome: str) -> int:
-        self.assicura_persona(nome)
-        return self.annuale[nome]
+        return int(self.annuale[self.assicura_persona(nome)])
 
     def tot_mese_giorno(self, nome: str, mese: int, dow: int) -> int:
-        self.assicura_persona(nome)
-        return self.per_mese_giorno[nome][mese][dow]
+        return int(self.per_mese_giorno[self.assicura_persona(nome), mese, dow])
 
     def tot_giorno_anno(self, nome: str, dow: int) -> int:
-        self.assicura_persona(nome)
-        return self.per_giorno_anno[nome][dow]
+        return int(self.per_giorno_anno[self.assicura_persona(nome), dow])
 
-    def tot_settimana(self, nome: str, week_key: Tuple[int, int]) -> int:
-        self.assicura_persona(nome)
-        return self.per_settimana[nome].get(week_key, 0)
+    def tot_settimana(self, nome: str, settimana: int) -> int:
+        return int(self.per_settimana[self.assicura_persona(nome), settimana])
 
     def ultimo_dow(self, nome: str) -> Optional[int]:
-        self.assicura_persona(nome)
-        return self.ultimo_giorno[nome]
+        dow = int(self.ultimo_giorno[self.assicura_persona(nome)])
+        return dow if dow >= 0 else None
+
+
+_LIMITE_CHIAVE = 1 << 62
+_EMPTY_FS: FrozenSet[str] = frozenset()
+# Ordine di visita dentro la settimana: sabato, venerdì, domenica, poi gli altri giorni
+_PRIORITA_DOW: Dict[int, int] = {5: 0, 4: 1, 6: 2}
+
+
+def _comprimi_colonne(colonne: List[np.ndarray], membri: int) -> List[np.ndarray]:
+    """Fonde colonne per-persona non negative, in ordine di priorità, in poche colonne int64.
+
+    Ogni colonna è pesata con il prodotto delle basi delle colonne meno importanti,
+    dove la base è un maggiorante della somma su `membri` persone: sommando la
+    colonna fusa sui membri di una squadra si ottiene lo stesso ordinamento del
+    confronto lessicografico fra le singole somme. Se il peso supera l'int64 si
+    apre una nuova colonna.
+    """
+    fuse: List[np.ndarray] = []
+    corrente: Optional[np.ndarray] = None
+    peso = 1
+    for colonna in reversed(colonne):
+        colonna = colonna.astype(np.int64)
+        base = membri * int(colonna.max(initial=0)) + 1
+        if corrente is not None and peso * base > _LIMITE_CHIAVE:
+            fuse.append(corrente)
+            corrente, peso = None, 1
+        corrente = colonna * peso if corrente is None else corrente + colonna * peso
+        peso *= base
+    if corrente is not None:
+        fuse.append(corrente)
+    fuse.reverse()
+    return fuse
+
+
+@functools.lru_cache(maxsize=64)
+def _combinazioni(n: int, k: int) -> np.ndarray:
+    """Tutte le combinazioni di k indici in range(n), una per riga (in sola lettura)."""
+    righe = list(itertools.combinations(range(n), k))
+    combinazioni = np.array(righe, dtype=np.intp).reshape(len(righe), k)
+    combinazioni.setflags(write=False)
+    return combinazioni
+
+
+def _valuta_squadre(
+    squadre: np.ndarray,
+    vietate_hard: np.ndarray,
+    vietate_soft: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Valuta i vincoli di coppia per tutte le squadre candidate in un colpo solo.
+
+    `squadre` contiene una squadra per riga come indici locali nelle matrici di
+    adiacenza. Ritorna per ogni squadra l'assenza di coppie vietate e il numero
+    di coppie sconsigliate.
+    """
+    n_squadre, membri = squadre.shape
+    valide = np.ones(n_squadre, dtype=bool)
+    violazioni_soft = np.zeros(n_squadre, dtype=np.int32)
+    for a, b in itertools.combinations(range(membri), 2):
+        valide &= ~vietate_hard[squadre[:, a], squadre[:, b]]
+        violazioni_soft += vietate_soft[squadre[:, a], squadre[:, b]]
+    return valide, violazioni_soft
+
+
+def _squadre_gia_viste(squadre: np.ndarray, viste: np.ndarray, n_candidati: int) -> np.ndarray:
+    """Ritorna 1 per le squadre (indici locali crescenti) già presenti in `viste`."""
+    n_squadre, membri = squadre.shape
+    if not membri or not len(viste):
+        return np.zeros(n_squadre, dtype=np.int32)
+    # Una squadra ordinata equivale a un numero in base n_candidati: confronto i codici
+    dims = (n_candidati,) * membri
+    gia_vista = np.isin(np.ravel_multi_index(squadre.T, dims), np.ravel_multi_index(viste.T, dims))
+    return gia_vista.astype(np.int32)
 
 
 @dataclass
@@ -126,162 +200,225 @@ class Scheduler:
         anno: int,
         config: ProgramConfig,
         months: Optional[Iterable[int]] = None,
-    ):
-        self.anno = anno
-        self.config = config
+        seed: Optional[int] = None,
+    ) -> None:
+        self.anno: int = anno
+        self.config: ProgramConfig = config
 
         self.autisti: List[str] = sorted(config.autisti)
         self.vigili: List[str] = sorted(config.vigili)
-        self.esperienza_vigili = {
+        self.esperienza_vigili: Dict[str, str] = {
             nome: config.esperienza_vigili.get(nome, LIV_JUNIOR) for nome in self.vigili
         }
+        self.senior_vig: np.ndarray = np.array(
+            [self.esperienza_vigili[nome] == LIV_SENIOR for nome in self.vigili], dtype=bool
+        )
 
-        self.forbidden_hard: Set[frozenset] = {
-            frozenset(rule.as_sorted_tuple()) for rule in config.coppie_vietate if rule.is_hard
-        }
-        self.forbidden_soft: Set[frozenset] = {
-            frozenset(rule.as_sorted_tuple()) for rule in config.coppie_vietate if not rule.is_hard
-        }
-        self.preferenze_hard: Dict[str, Set[str]] = {}
-        self.preferenze_soft: Dict[str, Set[str]] = {}
+        # Le coppie vietate sono matrici booleane simmetriche sugli indici dei vigili:
+        # forbidden_*_mat[i, j] indica che i e j non dovrebbero stare nella stessa squadra.
+        self.idx_aut: Dict[str, int] = {nome: i for i, nome in enumerate(self.autisti)}
+        self.idx_vig: Dict[str, int] = {nome: i for i, nome in enumerate(self.vigili)}
+        self.forbidden_hard_mat: np.ndarray = np.zeros((len(self.vigili), len(self.vigili)), dtype=bool)
+        self.forbidden_soft_mat: np.ndarray = np.zeros((len(self.vigili), len(self.vigili)), dtype=bool)
+        for coppia in config.coppie_vietate:
+            i = self.idx_vig.get(coppia.primo)
+            j = self.idx_vig.get(coppia.secondo)
+            if i is None or j is None or i == j:
+                continue
+            target_mat = self.forbidden_hard_mat if coppia.is_hard else self.forbidden_soft_mat
+            target_mat[i, j] = target_mat[j, i] = True
+        preferenze_hard: Dict[str, Set[str]] = {}
+        preferenze_soft: Dict[str, Set[str]] = {}
         for rule in config.coppie_preferite:
-            target = self.preferenze_hard if rule.is_hard else self.preferenze_soft
+            target = preferenze_hard if rule.is_hard else preferenze_soft
             target.setdefault(rule.autista, set()).add(rule.vigile)
+        self.preferenze_hard: Dict[str, FrozenSet[str]] = {
+            autista: frozenset(vigili) for autista, vigili in preferenze_hard.items()
+        }
+        self.preferenze_soft: Dict[str, FrozenSet[str]] = {
+            autista: frozenset(vigili) for autista, vigili in preferenze_soft.items()
+        }
 
-        self.weekly_cap = {nome: max(0, cap) for nome, cap in config.weekly_cap.items()}
-        self.default_weekly_cap = max(0, DEFAULT_WEEKLY_CAP)
-
-        self.rules = merge_with_defaults(config.generation_rules)
-        self.rule_min_senior = self.rules["min_senior"]
-        self.rule_weekly_cap = self.rules["weekly_cap"]
-        self.rule_summer = self.rules["summer_exclusion"]
-        self.rule_varchi = self.rules["varchi_rotation"]
-
-        self.enable_varchi_rule = bool(config.enable_varchi_rule) and self.rule_varchi.mode != RuleMode.OFF
-        self.autista_varchi = config.autista_varchi
-        self.autista_pogliani = config.autista_pogliani
-        self.vigile_escluso_estate = config.vigile_escluso_estate if self.rule_summer.mode != RuleMode.OFF else None
+        self.weekly_cap: Dict[str, int] = {nome: max(0, cap) for nome, cap in config.weekly_cap.items()}
+        self.default_weekly_cap: int = max(0, DEFAULT_WEEKLY_CAP)
+        self.cap_aut: np.ndarray = np.array([self._limite_settimanale(nome) for nome in self.autisti], dtype=np.int32)
+        self.cap_vig: np.ndarray = np.array([self._limite_settimanale(nome) for nome in self.vigili], dtype=np.int32)
+
+        self.rules: Dict[str, GenerationRuleConfig] = merge_with_defaults(config.generation_rules)
+        self.rule_min_senior: GenerationRuleConfig = self.rules["min_senior"]
+        self.rule_weekly_cap: GenerationRuleConfig = self.rules["weekly_cap"]
+        self.rule_summer: GenerationRuleConfig = self.rules["summer_exclusion"]
+        self.rule_varchi: GenerationRuleConfig = self.rules["varchi_rotation"]
+
+        self.enable_varchi_rule: bool = bool(config.enable_varchi_rule) and self.rule_varchi.mode != RuleMode.OFF
+        self.autista_varchi: Optional[str] = config.autista_varchi
+        self.autista_pogliani: Optional[str] = config.autista_pogliani
+        self.vigile_escluso_estate: Optional[str] = (
+            config.vigile_escluso_estate if self.rule_summer.mode != RuleMode.OFF else None
+        )
         min_rule_value = self.rule_min_senior.value if self.rule_min_senior.value is not None else config.min_esperti
-        self.min_esperti = max(0, min_rule_value)
-        self.active_weekdays = set(config.active_weekdays or DEFAULT_ACTIVE_WEEKDAYS)
+        self.min_esperti: int = max(0, min_rule_value)
+        self.active_weekdays: Set[int] = set(config.active_weekdays or DEFAULT_ACTIVE_WEEKDAYS)
         self.active_months: Set[int] = (
             {int(m) for m in months if 1 <= int(m) <= 12} if months else set(range(1, 13))
         )
         if not self.active_months:
             self.active_months = set(range(1, 13))
-        self.date = date_attive_anno(anno, self.active_weekdays, self.active_months)
+        self.date: List[date] = date_attive_anno(anno, self.active_weekdays, self.active_months)
         self.ferie: Dict[str, List[Vacation]] = {
             nome: list(vac) for nome, vac in config.ferie.items()
         }
 
-        self.cont_aut = Conteggi()
-        self.cont_vig = Conteggi()
-        for nome in self.autisti:
-            self.cont_aut.assicura_persona(nome)
-        for nome in self.vigili:
-            self.cont_vig.assicura_persona(nome)
-
-        self.squadre_visti: Set[frozenset] = set()
+        # Dati per data calcolati una volta sola e indicizzati per posizione in
+        # self.date: settimana ISO, giorni di ogni settimana e ferie
+        week_keys = [(giorno.isocalendar()[0], giorno.isocalendar()[1]) for giorno in self.date]
+        self.settimane: Dict[Tuple[int, int], int] = {
+            week_key: i for i, week_key in enumerate(sorted(set(week_keys)))
+        }
+        self.settimana_di: List[int] = [self.settimane[week_key] for week_key in week_keys]
+        self.giorni_per_settimana: List[List[int]] = [[] for _ in self.settimane]
+        for d, settimana in enumerate(self.settimana_di):
+            self.giorni_per_settimana[settimana].append(d)
+        dows = [giorno.weekday() for giorno in self.date]
+        self.ordered_days: List[int] = [
+            d
+            for giorni in self.giorni_per_settimana
+            for d in sorted(giorni, key=lambda d: (_PRIORITA_DOW.get(dows[d], 3), dows[d]))
+        ]
+        self.ferie_aut: np.ndarray = self._matrice_ferie(self.autisti)
+        self.ferie_vig: np.ndarray = self._matrice_ferie(self.vigili)
+
+        # Le righe dei contatori coincidono con idx_aut / idx_vig
+        self.cont_aut: Conteggi = Conteggi(self.autisti, len(self.settimane))
+        self.cont_vig: Conteggi = Conteggi(self.vigili, len(self.settimane))
+
+        self.squadre_visti: Set[int] = set()
+        # Spareggi fissati in anticipo per persona e giorno: senza seed esplicito
+        # li derivo da `random` per rispettare il seed globale
+        rng = np.random.default_rng(seed if seed is not None else random.getrandbits(64))
+        self.tiebreak_aut: np.ndarray = rng.integers(
+            0, 65536, size=(len(self.autisti), len(self.date)), dtype=np.int32
+        )
+        self.tiebreak_vig: np.ndarray = rng.integers(
+            0, 65536, size=(len(self.vigili), len(self.date)), dtype=np.int32
+        )
         self.log: List[str] = []
-        self.autisti_reali: Dict[date, Optional[str]] = {}
-        self.logger = logging.getLogger("vvf.scheduler")
+        self.autisti_reali: List[Optional[str]] = [None] * len(self.date)
+        self.logger: logging.Logger = logging.getLogger("vvf.scheduler")
 
         if not self.enable_varchi_rule:
             # Se la regola è disattivata, non forzo alcun nome speciale
             self.autista_varchi = None
             self.autista_pogliani = None
 
-        self.varchi_is_senior = (
+        self.varchi_is_senior: bool = (
             self.enable_varchi_rule
             and self.autista_varchi is not None
             and self.autista_varchi in self.vigili
             and self.esperienza_vigili.get(self.autista_varchi, LIV_JUNIOR) == LIV_SENIOR
         )
 
-    def _week_key(self, giorno: date) -> Tuple[int, int]:
-        iso = giorno.isocalendar()
-        return iso.year, iso.week
+    def _matrice_ferie(self, nomi: List[str]) -> np.ndarray:
+        """Matrice booleana persona × data pianificata: True se la persona è in ferie."""
+        giorni = np.array([giorno.toordinal() for giorno in self.date], dtype=np.int64)
+        matrice = np.zeros((len(nomi), len(self.date)), dtype=bool)
+        for i, nome in enumerate(nomi):
+            periodi = sorted((vac.start.toordinal(), vac.end.toordinal()) for vac in self.ferie.get(nome, []))
+            if not periodi:
+                continue
+            inizi, fini = np.array(periodi, dtype=np.int64).T
+            # Ultimo periodo iniziato entro ogni giorno; il massimo cumulativo delle
+            # fine copre anche periodi sovrapposti
+            ultimo = np.searchsorted(inizi, giorni, side="right") - 1
+            fine_max = np.maximum.accumulate(fini)
+            matrice[i] = (ultimo >= 0) & (fine_max[np.maximum(ultimo, 0)] >= giorni)
+        return matrice
+
+    def _maschera_squadra(self, squadra: Iterable[Optional[str]]) -> int:
+        mask = 0
+        for nome in squadra:
+            if nome:
+                mask |= 1 << self.idx_vig[nome]
+        return mask
+
+    def _squadre_viste_fra(self, righe: List[int], membri: int) -> np.ndarray:
+        """Squadre già schierate composte solo da `righe`, come indici locali ordinati."""
+        posizione = {1 << r: j for j, r in enumerate(righe)}
+        candidati_mask = sum(posizione)
+        viste: List[List[int]] = []
+        for mask in self.squadre_visti:
+            if mask.bit_count() != membri or mask & ~candidati_mask:
+                continue
+            locali: List[int] = []
+            while mask:
+                meno_significativo = mask & -mask
+                locali.append(posizione[meno_significativo])
+                mask ^= meno_significativo
+            viste.append(sorted(locali))
+        return np.array(viste, dtype=np.intp).reshape(-1, membri)
 
     def _limite_settimanale(self, nome: str) -> int:
         return self.weekly_cap.get(nome, self.default_weekly_cap)
 
-    def _ha_raggiunto_limite(self, conteggi: Conteggi, nome: str, giorno: date) -> bool:
+    def _ha_raggiunto_limite(self, conteggi: Conteggi, nome: str, settimana: int) -> bool:
         if self.rule_weekly_cap.mode == RuleMode.OFF:
             return False
-        raggiunto = self._limite_raggiunto_raw(conteggi, nome, giorno)
+        raggiunto = self._limite_raggiunto_raw(conteggi, nome, settimana)
         if raggiunto and self.rule_weekly_cap.mode == RuleMode.SOFT:
             return False
         return raggiunto
 
-    def _limite_raggiunto_raw(self, conteggi: Conteggi, nome: str, giorno: date) -> bool:
+    @staticmethod
+    def _limiti_raggiunti(conteggi: Conteggi, capienze: np.ndarray, settimana: int) -> np.ndarray:
+        """Versione vettoriale di _limite_raggiunto_raw su tutte le righe dei conteggi."""
+        return (capienze > 0) & (conteggi.per_settimana[:, settimana] >= capienze)
+
+    def _limite_raggiunto_raw(self, conteggi: Conteggi, nome: str, settimana: int) -> bool:
         cap = self._limite_settimanale(nome)
         if cap <= 0:
             return False
-        return conteggi.tot_settimana(nome, self._week_key(giorno)) >= cap
+        return conteggi.per_settimana[conteggi.indice[nome], settimana] >= cap
 
-    def _in_ferie(self, nome: str, giorno: date) -> bool:
-        for vac in self.ferie.get(nome, []):
-            if vac.start <= giorno <= vac.end:
-                return True
-        return False
-
-    def _preferenze_obbligatorie(self, autista: Optional[str]) -> Set[str]:
+    def _preferenze_obbligatorie(self, autista: Optional[str]) -> FrozenSet[str]:
         if not autista:
-            return set()
-        return set(self.preferenze_hard.get(autista, set()))
+            return _EMPTY_FS
+        return self.preferenze_hard.get(autista, _EMPTY_FS)
 
-    def _preferenze_soft(self, autista: Optional[str]) -> Set[str]:
+    def _preferenze_soft(self, autista: Optional[str]) -> FrozenSet[str]:
         if not autista:
-            return set()
-        return set(self.preferenze_soft.get(autista, set()))
+            return _EMPTY_FS
+        return self.preferenze_soft.get(autista, _EMPTY_FS)
 
     def _numero_vigili_previsti(self, dow: int) -> int:
         return 4
 
-    def _ordine_giorni(self, giorni: Dict[int, date]) -> List[int]:
-        ordine: List[int] = []
-        for dow in (5, 4, 6):
-            if dow in giorni:
-                ordine.append(dow)
-        for dow in sorted(giorni):
-            if dow not in (4, 5, 6):
-                ordine.append(dow)
-        return ordine
-
     def _trova_autista_settimanale(
-        self, assegnazioni: Dict[date, Assegnazione], giorno: date, target_dow: int
+        self, assegnazioni: List[Optional[Assegnazione]], d: int, target_dow: int
     ) -> Optional[str]:
-        week_key = self._week_key(giorno)
-        for data, assegnazione in assegnazioni.items():
-            if self._week_key(data) == week_key and data.weekday() == target_dow:
-                return self.autisti_reali.get(data, assegnazione.autista)
+        for j in self.giorni_per_settimana[self.settimana_di[d]]:
+            if assegnazioni[j] is not None and self.date[j].weekday() == target_dow:
+                return self.autisti_reali[j]
         return None
 
     def costruisci(self) -> List[Assegnazione]:
-        assegnazioni: Dict[date, Assegnazione] = {}
+        """Genera i turni dell'anno; le assegnazioni sono restituite in ordine di data."""
+        # Assegnazioni indicizzate per posizione in self.date
+        assegnazioni: List[Optional[Assegnazione]] = [None] * len(self.date)
 
-        per_settimana: Dict[Tuple[int, int], List[date]] = {}
-        for giorno in self.date:
-            per_settimana.setdefault(self._week_key(giorno), []).append(giorno)
-        for giorni in per_settimana.values():
-            giorni.sort()
+        for d in self.ordered_days:
+            assegnazioni[d] = self._costruisci_per_data(d, assegnazioni)
 
-        for _, giorni in sorted(per_settimana.items()):
-            giorni_per_dow = {d.weekday(): d for d in giorni}
-            for dow in self._ordine_giorni(giorni_per_dow):
-                giorno = giorni_per_dow[dow]
-                assegnazioni[giorno] = self._costruisci_per_data(giorno, assegnazioni)
-
-        return [assegnazioni[d] for d in sorted(assegnazioni)]
+        return [assegnazione for assegnazione in assegnazioni if assegnazione is not None]
 
     def _costruisci_per_data(
         self,
-        giorno: date,
-        assegnazioni: Dict[date, Assegnazione],
+        d: int,
+        assegnazioni: List[Optional[Assegnazione]],
     ) -> Assegnazione:
-        sabato_autista = self._trova_autista_settimanale(assegnazioni, giorno, 5)
+        giorno = self.date[d]
+        sabato_autista = self._trova_autista_settimanale(assegnazioni, d, 5)
         assegnazione, autista_reale = self._costruisci_per_data_internal(
-            giorno,
+            d,
             assegnazioni,
             sabato_autista=sabato_autista,
             apply_varchi=self.enable_varchi_rule,
@@ -298,22 +435,23 @@ class Scheduler:
                 "Deroga regola Varchi/Pogliani: ricompongo il turno senza il vincolo speciale.",
             )
             assegnazione, autista_reale = self._costruisci_per_data_internal(
-                giorno,
+                d,
                 assegnazioni,
                 sabato_autista=sabato_autista,
                 apply_varchi=False,
             )
-        self.autisti_reali[giorno] = autista_reale
+        self.autisti_reali[d] = autista_reale
         return assegnazione
 
     def _costruisci_per_data_internal(
         self,
-        giorno: date,
-        assegnazioni: Dict[date, Assegnazione],
+        d: int,
+        assegnazioni: List[Optional[Assegnazione]],
         *,
         sabato_autista: Optional[str],
         apply_varchi: bool,
     ) -> Tuple[Assegnazione, Optional[str]]:
+        giorno = self.date[d]
         dow = giorno.weekday()
 
         esclusioni_autista: Set[str] = set()
@@ -333,7 +471,7 @@ class Scheduler:
                 f"Regola: sabato guida {self.autista_pogliani} ⇒ venerdì escludo {self.autista_varchi}.",
             )
 
-        autista = self._scegli_autista(giorno, esclusioni_autista)
+        autista = self._scegli_autista(d, esclusioni_autista)
         display_autista = autista
         include_varchi = (
             apply_varchi
@@ -366,7 +504,7 @@ class Scheduler:
             esclusioni_vigili.add(self.autista_varchi)
 
         squadra = self._scegli_squadra_vigili(
-            giorno,
+            d,
             vigili_base,
             autista_corrente=autista,
             esclusioni=esclusioni_vigili,
@@ -374,12 +512,11 @@ class Scheduler:
 
         if squadra is None:
             self._log(giorno, "VIGILI", "Turno scoperto: impossibile comporre una squadra valida.")
-            vigili_list: List[Optional[str]] = [None, None, None, None]
-            return Assegnazione(giorno=giorno, autista=autista, vigili=tuple(vigili_list)), autista
+            return Assegnazione(giorno=giorno, autista=autista, vigili=(None, None, None, None)), autista
 
-        squadra_list = list(squadra)
+        squadra_list: List[Optional[str]] = list(squadra)
         if include_varchi:
-            squadra_list = self._aggiungi_varchi_venerdi(giorno, squadra_list)
+            squadra_list = self._aggiungi_varchi_venerdi(d, squadra_list)
 
         while len(squadra_list) < 4:
             squadra_list.append(None)
@@ -387,7 +524,7 @@ class Scheduler:
         assegnazione = Assegnazione(
             giorno=giorno,
             autista=display_autista,
-            vigili=tuple(squadra_list[:4]),
+            vigili=(squadra_list[0], squadra_list[1], squadra_list[2], squadra_list[3]),
         )
         return assegnazione, autista
 
@@ -397,32 +534,28 @@ class Scheduler:
             return True
         return any(v is None for v in assegnazione.vigili)
 
-    def _scegli_autista(self, giorno: date, esclusioni: Set[str]) -> Optional[str]:
+    def _scegli_autista(self, d: int, esclusioni: Set[str]) -> Optional[str]:
+        giorno = self.date[d]
         mese = giorno.month
         dow = giorno.weekday()
-        week_key = self._week_key(giorno)
-
-        candidati_info: List[Tuple[str, bool]] = []
-        for nome in self.autisti:
-            if nome in esclusioni:
-                continue
-            if self._in_ferie(nome, giorno):
-                continue
-            limit_raw = self._limite_raggiunto_raw(self.cont_aut, nome, giorno)
-            if self.rule_weekly_cap.mode == RuleMode.HARD and limit_raw:
-                continue
-            candidati_info.append((nome, limit_raw))
-
-        if not candidati_info:
+        settimana = self.settimana_di[d]
+        cont = self.cont_aut
+
+        idonei = ~self.ferie_aut[:, d]
+        for nome in esclusioni:
+            if nome in self.idx_aut:
+                idonei[self.idx_aut[nome]] = False
+        limiti = self._limiti_raggiunti(cont, self.cap_aut, settimana)
+        if self.rule_weekly_cap.mode == RuleMode.HARD:
+            idonei &= ~limiti
+        candidati = np.flatnonzero(idonei)
+
+        if not len(candidati):
             self._log(giorno, "AUTISTA", "Nessun autista disponibile rispettando vincoli e limiti settimanali.")
             return None
 
-        limit_map = {nome: limit for nome, limit in candidati_info}
-        candidati = [nome for nome, _ in candidati_info]
-        preferiti = [
-            nome for nome in candidati if self.cont_aut.tot_mese_giorno(nome, mese, dow) < 1
-        ]
-        if not preferiti:
+        preferiti = candidati[cont.per_mese_giorno[candidati, mese, dow] < 1]
+        if not len(preferiti):
             pool = candidati
             self._log(
                 giorno,
@@ -432,30 +565,32 @@ class Scheduler:
         else:
             pool = preferiti
 
-        pool.sort(
-            key=lambda nome: (
-                1 if limit_map[nome] else 0,
-                self.cont_aut.tot_settimana(nome, week_key),
-                self.cont_aut.tot_mese(nome, mese),
-                self.cont_aut.tot_annuale(nome),
-                self.cont_aut.tot_giorno_anno(nome, dow),
-                1 if self.cont_aut.ultimo_dow(nome) == dow else 0,
-                random.random(),
+        # np.lexsort usa l'ultima chiave come primaria
+        ordine = np.lexsort(
+            (
+                self.tiebreak_aut[pool, d],
+                cont.ultimo_giorno[pool] == dow,
+                cont.per_giorno_anno[pool, dow],
+                cont.annuale[pool],
+                cont.per_mese[pool, mese],
+                cont.per_settimana[pool, settimana],
+                limiti[pool],
             )
         )
-        scelto = pool[0]
-        if self.rule_weekly_cap.mode == RuleMode.SOFT and limit_map[scelto]:
+        scelto_idx = int(pool[ordine[0]])
+        scelto = self.autisti[scelto_idx]
+        if self.rule_weekly_cap.mode == RuleMode.SOFT and limiti[scelto_idx]:
             self._log(
                 giorno,
                 "AUTISTA",
                 f"Deroga limite settimanale: assegno {scelto} oltre il proprio limite.",
             )
-        self.cont_aut.aggiungi(scelto, giorno)
+        cont.aggiungi(scelto_idx, mese, dow, settimana)
         return scelto
 
     def _scegli_squadra_vigili(
         self,
-        giorno: date,
+        d: int,
         n_vigili: int,
         *,
         autista_corrente: Optional[str],
@@ -464,30 +599,35 @@ class Scheduler:
         if n_vigili <= 0:
             return tuple()
 
+        giorno = self.date[d]
         mese = giorno.month
         dow = giorno.weekday()
-        week_key = self._week_key(giorno)
+        settimana = self.settimana_di[d]
+        in_ferie = self.ferie_vig[:, d]
+        limiti = self._limiti_raggiunti(self.cont_vig, self.cap_vig, settimana)
+        escluso_estate = (
+            self.vigile_escluso_estate
+            if mese in SUMMER_EXCLUDED_MONTHS and self.rule_summer.mode != RuleMode.OFF
+            else None
+        )
+        summer_hard = self.rule_summer.mode == RuleMode.HARD
+        limite_hard = self.rule_weekly_cap.mode == RuleMode.HARD
 
         candidati_base: List[str] = []
         fallback_candidates: List[str] = []
         limit_map: Dict[str, bool] = {}
         summer_map: Dict[str, bool] = {}
-        for nome in self.vigili:
+        for i, nome in enumerate(self.vigili):
             # Raccolgo i candidati distinguendo quelli che violerebbero vincoli soft
             if nome in esclusioni:
                 continue
-            if self._in_ferie(nome, giorno):
+            if in_ferie[i]:
                 continue
-            summer_block = (
-                self.vigile_escluso_estate
-                and nome == self.vigile_escluso_estate
-                and mese in SUMMER_EXCLUDED_MONTHS
-                and self.rule_summer.mode != RuleMode.OFF
-            )
-            limit_raw = self._limite_raggiunto_raw(self.cont_vig, nome, giorno)
-            if self.rule_summer.mode == RuleMode.HARD and summer_block:
+            summer_block = escluso_estate is not None and nome == escluso_estate
+            limit_raw = bool(limiti[i])
+            if summer_hard and summer_block:
                 continue
-            if self.rule_weekly_cap.mode == RuleMode.HARD and limit_raw:
+            if limite_hard and limit_raw:
                 continue
             limit_map[nome] = limit_raw
             summer_map[nome] = summer_block
@@ -519,9 +659,7 @@ class Scheduler:
             )
             return None
 
-        ci_sono_senior = any(
-            self.esperienza_vigili.get(nome, LIV_JUNIOR) == LIV_SENIOR for nome in disponibili
-        )
+        ci_sono_senior = any(self.senior_vig[self.idx_vig[nome]] for nome in disponibili)
 
         obbligatori = self._preferenze_obbligatorie(autista_corrente)
         disponibili_obbligatori = [nome for nome in obbligatori if nome in disponibili]
@@ -551,76 +689,44 @@ class Scheduler:
             )
             return None
 
-        combinazioni = (
-            itertools.combinations(residui, slot_rimanenti)
-            if slot_rimanenti > 0
-            else [tuple()]
+        # Le squadre candidate sono righe di indici locali in `candidati`: i primi
+        # n_obbligatori sono fissi, gli altri enumerano le combinazioni dei residui.
+        candidati = disponibili_obbligatori + residui
+        n_obbligatori = len(disponibili_obbligatori)
+        extra = _combinazioni(len(residui), slot_rimanenti) + n_obbligatori
+        squadre = np.hstack(
+            (np.broadcast_to(np.arange(n_obbligatori, dtype=np.intp), (len(extra), n_obbligatori)), extra)
         )
 
-        soluzioni: List[Tuple[Tuple[float, ...], Tuple[str, ...], Dict[str, int]]] = []
-        deroga_senior_loggata = False
-
-        for extra in combinazioni:
-            team = tuple(disponibili_obbligatori + list(extra))
-            team_set = frozenset(team)
-
-            if any(frozenset(pair) in self.forbidden_hard for pair in itertools.combinations(team, 2)):
-                continue
-
-            senior_count = sum(
-                1 for nome in team if self.esperienza_vigili.get(nome, LIV_JUNIOR) == LIV_SENIOR
-            )
-            if self.min_esperti > 0:
-                if not ci_sono_senior and not deroga_senior_loggata:
-                    self._log(
-                        giorno,
-                        "VIGILI",
-                        "Deroga esperienza: nessun SENIOR disponibile fra i candidati di oggi.",
-                    )
-                    deroga_senior_loggata = True
-                if ci_sono_senior and senior_count < self.min_esperti:
-                    if self.rule_min_senior.mode == RuleMode.SOFT:
-                        if not deroga_senior_loggata:
-                            self._log(
-                                giorno,
-                                "VIGILI",
-                                f"Deroga esperienza: squadra con {senior_count} SENIOR (<{self.min_esperti}).",
-                            )
-                            deroga_senior_loggata = True
-                    else:
-                        continue
-
-            violazioni_soft = sum(
-                1 for pair in itertools.combinations(team, 2) if frozenset(pair) in self.forbidden_soft
-            )
-            violazioni_mese_dow = sum(
-                1 for nome in team if self.cont_vig.tot_mese_giorno(nome, mese, dow) >= 1
-            )
-            squadra_nuova = 0 if team_set not in self.squadre_visti else 1
-            carico_settimanale = sum(self.cont_vig.tot_settimana(nome, week_key) for nome in team)
-            carico_mensile = sum(self.cont_vig.tot_mese(nome, mese) for nome in team)
-            carico_annuale = sum(self.cont_vig.tot_annuale(nome) for nome in team)
-            carico_giorno = sum(self.cont_vig.tot_giorno_anno(nome, dow) for nome in team)
-            ripetizioni_recenti = sum(1 for nome in team if self.cont_vig.ultimo_dow(nome) == dow)
-            preferenze_soft = -sum(
-                1 for nome in team if nome in self._preferenze_soft(autista_corrente)
-            )
-
-            punteggio = (
-                violazioni_soft,
-                violazioni_mese_dow,
-                squadra_nuova,
-                carico_settimanale,
-                carico_mensile,
-                carico_annuale,
-                carico_giorno,
-                ripetizioni_recenti,
-                preferenze_soft,
-                random.random(),
-            )
-            soluzioni.append((punteggio, team, {"violazioni_soft": violazioni_soft}))
+        righe_cont = [self.idx_vig[nome] for nome in candidati]
+        valide_arr, soft_arr = _valuta_squadre(
+            squadre,
+            self.forbidden_hard_mat[np.ix_(righe_cont, righe_cont)],
+            self.forbidden_soft_mat[np.ix_(righe_cont, righe_cont)],
+        )
 
-        if not soluzioni:
+        senior_count = self.senior_vig[righe_cont][squadre].sum(axis=1)
+        if self.min_esperti > 0 and valide_arr.any():
+            if not ci_sono_senior:
+                self._log(
+                    giorno,
+                    "VIGILI",
+                    "Deroga esperienza: nessun SENIOR disponibile fra i candidati di oggi.",
+                )
+            else:
+                sotto_soglia = valide_arr & (senior_count < self.min_esperti)
+                if self.rule_min_senior.mode == RuleMode.SOFT:
+                    if sotto_soglia.any():
+                        primo = int(np.argmax(sotto_soglia))
+                        self._log(
+                            giorno,
+                            "VIGILI",
+                            f"Deroga esperienza: squadra con {senior_count[primo]} SENIOR (<{self.min_esperti}).",
+                        )
+                else:
+                    valide_arr &= ~sotto_soglia
+
+        if not valide_arr.any():
             self._log(
                 giorno,
                 "VIGILI",
@@ -628,9 +734,42 @@ class Scheduler:
             )
             return None
 
-        soluzioni.sort(key=lambda item: item[0])
-        team = soluzioni[0][1]
-        info = soluzioni[0][2]
+        cont = self.cont_vig
+        prefs_soft = self._preferenze_soft(autista_corrente)
+        mese_dow_vec = (cont.per_mese_giorno[righe_cont, mese, dow] >= 1).astype(np.int32)
+        week_vec = cont.per_settimana[righe_cont, settimana]
+        mese_vec = cont.per_mese[righe_cont, mese]
+        annuale_vec = cont.annuale[righe_cont]
+        giorno_vec = cont.per_giorno_anno[righe_cont, dow]
+        ultimo_vec = (cont.ultimo_giorno[righe_cont] == dow).astype(np.int32)
+        pref_vec = np.fromiter((n in prefs_soft for n in candidati), dtype=np.int32, count=len(candidati))
+
+        # Potatura: il punteggio è lessicografico, quindi dopo ogni componente
+        # tengo solo le squadre al minimo e calcolo le successive sulle superstiti.
+        squadre = squadre[valide_arr]
+        soft_arr = soft_arr[valide_arr]
+        violazioni_soft = int(soft_arr.min())
+        squadre = squadre[soft_arr == violazioni_soft]
+        mese_dow_arr = mese_dow_vec[squadre].sum(axis=1)
+        squadre = squadre[mese_dow_arr == mese_dow_arr.min()]
+        nuova_arr = _squadre_gia_viste(
+            squadre, self._squadre_viste_fra(righe_cont, squadre.shape[1]), len(candidati)
+        )
+        squadre = squadre[nuova_arr == nuova_arr.min()]
+
+        # Le componenti additive del punteggio diventano un costo per persona:
+        # il carico di una squadra è la somma dei costi dei suoi membri.
+        costi = _comprimi_colonne(
+            [week_vec, mese_vec, annuale_vec, giorno_vec, ultimo_vec, 1 - pref_vec],
+            squadre.shape[1],
+        )
+        for costo in costi:
+            carico = costo[squadre].sum(axis=1)
+            squadre = squadre[carico == carico.min()]
+        spareggio = self.tiebreak_vig[righe_cont, d][squadre].sum(axis=1)
+        migliore = int(np.argmin(spareggio))
+        team = tuple(candidati[j] for j in squadre[migliore].tolist())
+        info = {"violazioni_soft": violazioni_soft}
         if info.get("violazioni_soft"):
             self._log(
                 giorno,
@@ -638,7 +777,8 @@ class Scheduler:
                 f"Deroga: utilizzo squadra con {info['violazioni_soft']} coppia/e sconsigliate.",
             )
 
-        if frozenset(team) in self.squadre_visti:
+        team_mask = self._maschera_squadra(team)
+        if team_mask in self.squadre_visti:
             self._log(
                 giorno,
                 "VIGILI",
@@ -663,24 +803,26 @@ class Scheduler:
                     )
 
         for nome in team:
-            self.cont_vig.aggiungi(nome, giorno)
-        self.squadre_visti.add(frozenset(team))
+            self.cont_vig.aggiungi(self.idx_vig[nome], mese, dow, settimana)
+        self.squadre_visti.add(team_mask)
 
         return team
 
-    def _aggiungi_varchi_venerdi(self, giorno: date, squadra: List[Optional[str]]) -> List[Optional[str]]:
+    def _aggiungi_varchi_venerdi(self, d: int, squadra: List[Optional[str]]) -> List[Optional[str]]:
         if not self.autista_varchi:
             return squadra
         if self.autista_varchi in squadra:
             return squadra
-        if self._in_ferie(self.autista_varchi, giorno):
+        giorno = self.date[d]
+        settimana = self.settimana_di[d]
+        if self.ferie_vig[self.idx_vig[self.autista_varchi], d]:
             self._log(
                 giorno,
                 "VIGILI",
                 f"{self.autista_varchi} è in ferie: venerdì senza vigile speciale.",
             )
             return squadra
-        if self._ha_raggiunto_limite(self.cont_vig, self.autista_varchi, giorno):
+        if self._ha_raggiunto_limite(self.cont_vig, self.autista_varchi, settimana):
             self._log(
                 giorno,
                 "VIGILI",
@@ -689,8 +831,10 @@ class Scheduler:
             return squadra
 
         squadra.append(self.autista_varchi)
-        self.cont_vig.aggiungi(self.autista_varchi, giorno)
-        self.squadre_visti.add(frozenset(x for x in squadra if x))
+        self.cont_vig.aggiungi(
+            self.idx_vig[self.autista_varchi], giorno.month, giorno.weekday(), settimana
+        )
+        self.squadre_visti.add(self._maschera_squadra(squadra))
         self._log(
             giorno,
             "VIGILI",
@@ -2,16 +2,16 @@
 
 from __future__ import annotations
 
+import functools
+import itertools
+import zipfile
 from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Sequence
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from uuid import uuid4
+from xml.sax.saxutils import escape, quoteattr
 
-try:
-    import pandas as pd
-except ImportError as exc:  # pragma: no cover - dipendenza opzionale
-    raise RuntimeError(
-        "Questo script richiede pandas. Installa con: pip install pandas openpyxl"
-    ) from exc
+import numpy as np
 
 from .constants import MESI_IT, NOME_GIORNO, TZID
 from .core import Assegnazione, Conteggi
@@ -35,6 +35,148 @@ RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU
 END:STANDARD
 END:VTIMEZONE"""
 
+ICS_HEADER_TEMPLATE = (
+    "BEGIN:VCALENDAR\n"
+    "PRODID:-//VVF Scheduler//IT\n"
+    "VERSION:2.0\n"
+    "CALSCALE:GREGORIAN\n"
+    "METHOD:PUBLISH\n"
+    "X-WR-CALNAME:Turni VVF {anno}\n"
+    f"X-WR-TIMEZONE:{TZID}\n" + VTIMEZONE_EUROPE_ROME
+)
+ICS_TRAILER = "\nEND:VCALENDAR"
+
+_WEEKDAY_NAMES: Tuple[str, ...] = tuple(NOME_GIORNO.get(i, str(i)) for i in range(7))
+MONTH_COLS: Tuple[str, ...] = ("Data", "Giorno", "Autista", "Vigile1", "Vigile2", "Vigile3", "Vigile4")
+
+# Colonne del report: per ogni mese il totale e la ripartizione per giorno della settimana
+REPORT_COLUMNS_MESE: Dict[int, Tuple[str, ...]] = {
+    mese: (MESI_IT[mese],)
+    + tuple(f"{MESI_IT[mese]} {giorno}" for giorno in ("Lun", "Mar", "Mer", "Gio", "Ven", "Sab", "Dom"))
+    for mese in range(1, 13)
+}
+REPORT_COLUMNS_GIORNI: Tuple[str, ...] = (
+    "Lunedì", "Martedì", "Mercoledì", "Giovedì", "Venerdì", "Sabato", "Domenica"
+)
+
+# Parti fisse del pacchetto .xlsx (SpreadsheetML minimale, senza stili)
+_NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+_XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+XLSX_CONTENT_TYPES = (
+    _XML_DECL
+    + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    "{sheets}</Types>"
+)
+XLSX_CONTENT_TYPE_SHEET = (
+    '<Override PartName="/xl/worksheets/sheet{n}.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+)
+XLSX_ROOT_RELS = (
+    _XML_DECL + f'<Relationships xmlns="{_NS_PKG_REL}">'
+    f'<Relationship Id="rId1" Type="{_NS_REL}/officeDocument" Target="xl/workbook.xml"/>'
+    "</Relationships>"
+)
+XLSX_WORKBOOK = (
+    _XML_DECL + f'<workbook xmlns="{_NS_MAIN}" xmlns:r="{_NS_REL}"><sheets>{{sheets}}</sheets></workbook>'
+)
+XLSX_WORKBOOK_SHEET = '<sheet name={sheet_name} sheetId="{n}" r:id="rId{n}"/>'
+XLSX_WORKBOOK_RELS = _XML_DECL + f'<Relationships xmlns="{_NS_PKG_REL}">{{rels}}</Relationships>'
+XLSX_WORKBOOK_REL = f'<Relationship Id="rId{{n}}" Type="{_NS_REL}/{{tipo}}" Target="{{target}}"/>'
+XLSX_STYLES = (
+    _XML_DECL + f'<styleSheet xmlns="{_NS_MAIN}">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    "</styleSheet>"
+)
+XLSX_SHEET_HEAD = _XML_DECL + f'<worksheet xmlns="{_NS_MAIN}"><sheetData>'
+XLSX_SHEET_TAIL = "</sheetData></worksheet>"
+
+
+@functools.lru_cache(maxsize=None)
+def _colonna_excel(indice: int) -> str:
+    """Lettera della colonna Excel (0 → A, 26 → AA)."""
+    lettere = ""
+    indice += 1
+    while indice:
+        indice, resto = divmod(indice - 1, 26)
+        lettere = chr(ord("A") + resto) + lettere
+    return lettere
+
+
+def _riga_xml(numero: int, valori: Sequence[object]) -> str:
+    """Serializza una riga di foglio; le stringhe vuote non generano celle."""
+    celle: List[str] = []
+    for j, valore in enumerate(valori):
+        if isinstance(valore, str):
+            if valore:
+                celle.append(
+                    f'<c r="{_colonna_excel(j)}{numero}" t="inlineStr">'
+                    f'<is><t xml:space="preserve">{escape(valore)}</t></is></c>'
+                )
+        elif valore is not None:
+            celle.append(f'<c r="{_colonna_excel(j)}{numero}"><v>{valore}</v></c>')
+    return f'<row r="{numero}">{"".join(celle)}</row>'
+
+
+def _render_month_xml(righe: Sequence[Tuple[str, ...]]) -> str:
+    """XML delle righe di un foglio mensile: intestazione più una riga per turno."""
+    righe_xml = [_riga_xml(1, MONTH_COLS)]
+    righe_xml.extend(_riga_xml(numero, riga) for numero, riga in enumerate(righe, start=2))
+    return "".join(righe_xml)
+
+
+def _scrivi_xlsx(out_path: Path, fogli: Sequence[Tuple[str, Iterable[str]]]) -> None:
+    """Scrive il pacchetto .xlsx dal nome di ogni foglio e dai pezzi XML delle sue righe.
+
+    I pezzi vengono compressi man mano nell'archivio, senza comporre in memoria
+    l'XML completo del foglio.
+    """
+    n_fogli = len(fogli)
+    rels = [
+        XLSX_WORKBOOK_REL.format(n=n, tipo="worksheet", target=f"worksheets/sheet{n}.xml")
+        for n in range(1, n_fogli + 1)
+    ]
+    rels.append(XLSX_WORKBOOK_REL.format(n=n_fogli + 1, tipo="styles", target="styles.xml"))
+    with zipfile.ZipFile(out_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(
+            "[Content_Types].xml",
+            XLSX_CONTENT_TYPES.format(
+                sheets="".join(XLSX_CONTENT_TYPE_SHEET.format(n=n) for n in range(1, n_fogli + 1))
+            ),
+        )
+        zf.writestr("_rels/.rels", XLSX_ROOT_RELS)
+        zf.writestr(
+            "xl/workbook.xml",
+            XLSX_WORKBOOK.format(
+                sheets="".join(
+                    XLSX_WORKBOOK_SHEET.format(sheet_name=quoteattr(nome), n=n)
+                    for n, (nome, _) in enumerate(fogli, start=1)
+                )
+            ),
+        )
+        zf.writestr("xl/_rels/workbook.xml.rels", XLSX_WORKBOOK_RELS.format(rels="".join(rels)))
+        zf.writestr("xl/styles.xml", XLSX_STYLES)
+        for n, (_, righe_xml) in enumerate(fogli, start=1):
+            with zf.open(f"xl/worksheets/sheet{n}.xml", "w") as foglio:
+                foglio.write(XLSX_SHEET_HEAD.encode("utf-8"))
+                for pezzo in righe_xml:
+                    foglio.write(pezzo.encode("utf-8"))
+                foglio.write(XLSX_SHEET_TAIL.encode("utf-8"))
+
 
 def scrivi_excel(
     assegnazioni: List[Assegnazione],
@@ -46,40 +188,35 @@ def scrivi_excel(
     out_path: Path,
     selected_months: Optional[Iterable[int]] = None,
 ) -> None:
-    """Esporta l'esito dei turni in formato Excel (uno sheet per mese + report)."""
+    """Esporta l'esito dei turni in formato Excel (uno sheet per mese + report).
+
+    I fogli sono serializzati direttamente in XML e compressi nel pacchetto
+    .xlsx, senza passare per gli oggetti cella di una libreria Excel.
+    """
+    # Scheduler.costruisci restituisce i turni in ordine di data: ogni mese resta ordinato
     per_mese: Dict[int, List[Assegnazione]] = {mese: [] for mese in range(1, 13)}
     for assegnazione in assegnazioni:
         per_mese[assegnazione.giorno.month].append(assegnazione)
 
-    def _build_report_table(nomi: List[str], cont: Conteggi, mesi_rilevanti: Sequence[int]) -> pd.DataFrame:
-        colonne = ["Nome", "Turni totali"]
-        for mese in mesi_rilevanti:
-            colonne.extend(
-                [
-                    MESI_IT[mese],
-                    f"{MESI_IT[mese]} Lun",
-                    f"{MESI_IT[mese]} Mar",
-                    f"{MESI_IT[mese]} Mer",
-                    f"{MESI_IT[mese]} Gio",
-                    f"{MESI_IT[mese]} Ven",
-                    f"{MESI_IT[mese]} Sab",
-                    f"{MESI_IT[mese]} Dom",
-                ]
+    def _build_report_table(
+        nomi: List[str], cont: Conteggi, mesi_rilevanti: Sequence[int]
+    ) -> Iterator[List[object]]:
+        """Genera le righe del report, ricavate in blocco dagli array dei conteggi."""
+        righe = [cont.assicura_persona(nome) for nome in nomi]
+        mesi = list(mesi_rilevanti)
+        # Per ogni mese: totale del mese seguito dai sette giorni della settimana
+        per_mese = np.concatenate(
+            (cont.per_mese[righe][:, mesi, None], cont.per_mese_giorno[righe][:, mesi, :]), axis=2
+        )
+        valori = np.hstack(
+            (
+                cont.annuale[righe, None],
+                per_mese.reshape(len(righe), per_mese.shape[1] * per_mese.shape[2]),
+                cont.per_giorno_anno[righe],
             )
-        colonne.extend(["Lunedì", "Martedì", "Mercoledì", "Giovedì", "Venerdì", "Sabato", "Domenica"])
-
-        righe = []
-        for nome in nomi:
-            tot_annuale = cont.tot_annuale(nome)
-            valori: List[int] = []
-            for mese in mesi_rilevanti:
-                tot_mese = cont.tot_mese(nome, mese)
-                valori.append(tot_mese)
-                for dow in range(7):
-                    valori.append(cont.per_mese_giorno[nome][mese][dow])
-            valori.extend(cont.per_giorno_anno[nome][dow] for dow in range(7))
-            righe.append([nome, tot_annuale] + valori)
-        return pd.DataFrame(righe, columns=colonne)
+        )
+        for nome, riga in zip(nomi, valori.tolist()):
+            yield [nome, *riga]
 
     mesi_excel = (
         sorted({int(m) for m in selected_months if 1 <= int(m) <= 12})
@@ -89,75 +226,75 @@ def scrivi_excel(
     if not mesi_excel:
         mesi_excel = list(range(1, 13))
 
-    with pd.ExcelWriter(out_path, engine="openpyxl") as writer:
-        for mese in mesi_excel:
-            righe = []
-            for assegnazione in sorted(per_mese[mese], key=lambda a: a.giorno):
-                dow = assegnazione.giorno.weekday()
-                righe.append(
-                    {
-                        "Data": assegnazione.giorno.strftime("%Y-%m-%d"),
-                        "Giorno": NOME_GIORNO.get(dow, str(dow)),
-                        "Autista": assegnazione.autista or "",
-                        "Vigile1": assegnazione.vigili[0] or "",
-                        "Vigile2": assegnazione.vigili[1] or "",
-                        "Vigile3": assegnazione.vigili[2] or "",
-                        "Vigile4": assegnazione.vigili[3] or "",
-                    }
+    fogli: List[Tuple[str, Iterable[str]]] = []
+    for mese in mesi_excel:
+        righe: List[Tuple[str, ...]] = []
+        for assegnazione in per_mese[mese]:
+            giorno = assegnazione.giorno
+            righe.append(
+                (
+                    giorno.isoformat(),
+                    _WEEKDAY_NAMES[giorno.weekday()],
+                    assegnazione.autista or "",
+                    assegnazione.vigili[0] or "",
+                    assegnazione.vigili[1] or "",
+                    assegnazione.vigili[2] or "",
+                    assegnazione.vigili[3] or "",
                 )
-            df = pd.DataFrame(
-                righe, columns=["Data", "Giorno", "Autista", "Vigile1", "Vigile2", "Vigile3", "Vigile4"]
             )
-            nome_foglio = MESI_IT[mese]
-            df.to_excel(writer, sheet_name=nome_foglio, index=False)
+        fogli.append((MESI_IT[mese], (_render_month_xml(righe),)))
+
+    colonne = (
+        "Nome",
+        "Turni totali",
+        *itertools.chain.from_iterable(REPORT_COLUMNS_MESE[mese] for mese in mesi_excel),
+        *REPORT_COLUMNS_GIORNI,
+    )
 
-        report_vig = _build_report_table(vigili, cont_vig, mesi_excel)
-        report_aut = _build_report_table(autisti, cont_aut, mesi_excel)
-        report_vig.to_excel(writer, sheet_name="Report", index=False, startrow=1)
-        offset = len(report_vig) + 4
-        report_aut.to_excel(writer, sheet_name="Report", index=False, startrow=offset)
+    def _righe_report() -> Iterator[str]:
+        # Report: riga vuota, tabella vigili, due righe vuote, tabella autisti
+        numero = 2
+        for nomi, cont in ((vigili, cont_vig), (autisti, cont_aut)):
+            yield _riga_xml(numero, colonne)
+            for numero, riga in enumerate(_build_report_table(nomi, cont, mesi_excel), start=numero + 1):
+                yield _riga_xml(numero, riga)
+            numero += 3
+
+    fogli.append(("Report", _righe_report()))
+    _scrivi_xlsx(out_path, fogli)
 
 
 def scrivi_ics(assegnazioni: List[Assegnazione], anno: int, out_path: Path) -> None:
-    """Crea un file ICS con gli eventi per autisti e vigili."""
-    righe: List[str] = [
-        "BEGIN:VCALENDAR",
-        "PRODID:-//VVF Scheduler//IT",
-        "VERSION:2.0",
-        "CALSCALE:GREGORIAN",
-        "METHOD:PUBLISH",
-        f"X-WR-CALNAME:Turni VVF {anno}",
-        f"X-WR-TIMEZONE:{TZID}",
-        VTIMEZONE_EUROPE_ROME,
-    ]
+    """Crea un file ICS con gli eventi per autisti e vigili, scrivendoli man mano su file."""
+    # Il DTSTAMP indica quando è stato prodotto il calendario: uguale per tutti gli eventi
+    dtstamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    # Gli UID devono solo essere unici: un prefisso casuale per calendario più un contatore
+    prefisso_uid = uuid4().hex
+    contatore_uid = itertools.count()
 
     def _fmt_dt_locale(dt: datetime) -> str:
-        return dt.strftime("%Y%m%dT%H%M%S")
-
-    def _aggiungi_evento(nome: str, giorno: date, ora_inizio: int) -> None:
-        from uuid import uuid4
-
-        start = datetime(giorno.year, giorno.month, giorno.day, ora_inizio, 0, 0)
-        end = start + timedelta(hours=1)
-        uid = f"{uuid4()}@vvf-scheduler"
-        righe.extend(
-            [
-                "BEGIN:VEVENT",
-                f"UID:{uid}",
-                f"DTSTAMP:{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}",
-                f"DTSTART;TZID={TZID}:{_fmt_dt_locale(start)}",
-                f"DTEND;TZID={TZID}:{_fmt_dt_locale(end)}",
-                f"SUMMARY:{nome}",
-                "END:VEVENT",
-            ]
-        )
+        return f"{dt.year:04d}{dt.month:02d}{dt.day:02d}T{dt.hour:02d}{dt.minute:02d}{dt.second:02d}"
 
-    for assegnazione in assegnazioni:
-        if assegnazione.autista:
-            _aggiungi_evento(assegnazione.autista, assegnazione.giorno, 11)
-        for indice, nome in enumerate(assegnazione.vigili):
-            if nome:
-                _aggiungi_evento(nome, assegnazione.giorno, 12 + indice)
-
-    righe.append("END:VCALENDAR")
-    out_path.write_text("\n".join(righe), encoding="utf-8")
+    with out_path.open("w", encoding="utf-8", buffering=1 << 16) as f:
+
+        def _aggiungi_evento(nome: str, giorno: date, ora_inizio: int) -> None:
+            start = datetime(giorno.year, giorno.month, giorno.day, ora_inizio, 0, 0)
+            end = start + timedelta(hours=1)
+            f.write(
+                "\nBEGIN:VEVENT"
+                f"\nUID:{prefisso_uid}-{next(contatore_uid)}@vvf-scheduler"
+                f"\nDTSTAMP:{dtstamp}"
+                f"\nDTSTART;TZID={TZID}:{_fmt_dt_locale(start)}"
+                f"\nDTEND;TZID={TZID}:{_fmt_dt_locale(end)}"
+                f"\nSUMMARY:{nome}"
+                "\nEND:VEVENT"
+            )
+
+        f.write(ICS_HEADER_TEMPLATE.format(anno=anno))
+        for assegnazione in assegnazioni:
+            if assegnazione.autista:
+                _aggiungi_evento(assegnazione.autista, assegnazione.giorno, 11)
+            for indice, nome in enumerate(assegnazione.vigili):
+                if nome:
+                    _aggiungi_evento(nome, assegnazione.giorno, 12 + indice)
+        f.write(ICS_TRAILER)
@@ -22,7 +22,7 @@ def esegui(
     months: Optional[Sequence[int]] = None,
     seed: Optional[int] = None,
 ) -> Tuple[Path, Path, Path, Scheduler]:
-    scheduler = Scheduler(anno, config, months)
+    scheduler = Scheduler(anno, config, months, seed)
     assegnazioni = scheduler.costruisci()
 
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -54,9 +54,9 @@ def esegui(
         header.append(
             f"Mesi pianificati: {', '.join(MESI_IT[m] for m in sorted(scheduler.active_months))}"
         )
-    log_path.write_text(
-        "\n".join(header + ["", "Registro decisioni/deroghe:"] + scheduler.log),
-        encoding="utf-8",
-    )
+    with log_path.open("w", encoding="utf-8", buffering=1 << 16) as f:
+        f.write("\n".join(header))
+        f.write("\n\nRegistro decisioni/deroghe:")
+        f.writelines("\n" + riga for riga in scheduler.log)
     logger.info("Generazione completata: %s", out_dir)
     return xlsx_path, ics_path, log_path, scheduler